@@ -16,23 +16,33 @@ pip install opencv-python mediapipe numpy
 
 import cv2
 import time
+from collections import deque
 import numpy as np
-import hashlib
-import mediapipe as mp
 from blink_utils import (
-    BLINK_TO_DIGIT,
     EAR_THRESHOLD,
     BLINK_DURATION_THRESHOLD,
     MIN_BLINK_INTERVAL,
     CONSEC_FRAMES,
     MAX_BLINKS,
-    LEFT_EYE_LANDMARKS,
-    RIGHT_EYE_LANDMARKS,
-    calculate_ear,
-    get_landmark_coords,
+    FRAME_WIDTH,
+    FRAME_HEIGHT,
+    INFER_EVERY,
+    ear_pair,
+    extract_eyes,
+    draw_eye_landmarks,
+    inference_size,
+    ear_window_size,
+    calibration_frames,
+    compute_ear_threshold,
+    configure_opencv,
     create_face_mesh,
-    hash_pin,
+    FrameGrabber,
+    start_log_worker,
+    stop_log_worker,
+    render_hud,
+    verify_pin,
     get_user_pin_hash,
+    get_user_ear_threshold,
 )
 
 # -------------------
@@ -40,54 +50,6 @@ from blink_utils import (
 # -------------------
 PIN = None  # Loaded per user
 
-# -------------------
-# HELPER FUNCTIONS
-# -------------------
-
-def hash_pin(pin):
-    """Hash PIN using SHA-256"""
-    return hashlib.sha256(pin.encode()).hexdigest()
-
-def calculate_ear(eye_points):
-    """
-    Calculate Eye Aspect Ratio using the standard formula.
-    eye_points should be 6 landmarks in this order:
-    [0] = outer corner
-    [1] = top point 1 
-    [2] = top point 2
-    [3] = inner corner  
-    [4] = bottom point 1
-    [5] = bottom point 2
-    """
-    # Convert to numpy array
-    points = np.array(eye_points, dtype=np.float32)
-    
-    # Calculate the euclidean distances between the two sets of
-    # vertical eye landmarks (x, y)-coordinates
-    A = np.linalg.norm(points[1] - points[5])  # Vertical distance 1
-    B = np.linalg.norm(points[2] - points[4])  # Vertical distance 2
-    
-    # Calculate the euclidean distance between the horizontal
-    # eye landmark (x, y)-coordinates
-    C = np.linalg.norm(points[0] - points[3])  # Horizontal distance
-    
-    # Calculate the eye aspect ratio
-    if C == 0:
-        return 0
-    
-    ear = (A + B) / (2.0 * C)
-    return ear
-
-def get_landmark_coords(landmarks, indices, width, height):
-    """Extract landmark coordinates and convert to pixels"""
-    coords = []
-    for idx in indices:
-        landmark = landmarks.landmark[idx]
-        x = int(landmark.x * width)
-        y = int(landmark.y * height)
-        coords.append([x, y])
-    return coords
-
 # -------------------
 # MEDIAPIPE SETUP
 # -------------------
@@ -110,148 +72,182 @@ print("[INFO] Quick blink = 0, Long blink = 1")
 print("[INFO] Press 'q' to quit, 'r' to reset")
 
 # Initialize video capture
+configure_opencv()
 cap = cv2.VideoCapture(0)
 if not cap.isOpened():
     print("[ERROR] Cannot access camera")
     exit()
 
 # Set camera properties
-cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
+cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
+cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
 
 # State variables
-blink_sequence = []
+sequence_str = ""
 frame_counter = 0
-ear_history = []
+fps = cap.get(cv2.CAP_PROP_FPS)
+ear_history = deque(maxlen=ear_window_size(fps))
+ear_sum = 0.0
 is_blinking = False
 blink_start_time = 0
 last_blink_time = 0
 consec_blinks = 0
+eye_buf = np.zeros((12, 2), np.float32)
+ear_pair(eye_buf.reshape(2, 6, 2))  # Compile the EAR kernel before the loop
+last_landmarks = None
+frame_shape = (FRAME_HEIGHT, FRAME_WIDTH, 3)
+h, w = FRAME_HEIGHT, FRAME_WIDTH
+infer_size = inference_size(w, h)
+small_buf = np.empty((infer_size[1], infer_size[0], 3), np.uint8)
+rgb_small_buf = np.empty_like(small_buf)
+
+# Per-user EAR threshold: use the one stored at registration, otherwise
+# calibrate from the first face frames of this session
+ear_threshold = get_user_ear_threshold(username)
+if ear_threshold is None:
+    ear_threshold = EAR_THRESHOLD
+    baseline = np.empty(calibration_frames(fps), np.float64)
+else:
+    baseline = np.empty(0, np.float64)
+n_baseline = 0
+
+# On-screen status, drawn once per frame by render_hud
+hud = {
+    "face": False,
+    "ear": 0.0,
+    "threshold": ear_threshold,
+    "calibrating": baseline.size > 0,
+    "blink_started": False,
+    "detected": None,
+    "pin_count": 0,
+    "sequence": "",
+    "overlay": None,
+}
 
 print("[INFO] Camera initialized. Starting detection...")
 
 # Initialize face mesh after we have a valid user and camera
 face_mesh = create_face_mesh()
 
+# Console output from inside the capture loop goes through a background thread
+log_q, log_thread = start_log_worker()
+
+# Grab frames on a background thread so camera latency overlaps inference
+grabber = FrameGrabber(cap)
+grabber.start()
+
 while True:
-    ret, frame = cap.read()
+    ret, frame = grabber.read()
     if not ret:
-        print("[ERROR] Failed to read frame")
+        log_q.put("[ERROR] Failed to read frame")
         break
     
     frame_counter += 1
     
     # Flip for mirror effect
     frame = cv2.flip(frame, 1)
-    h, w, _ = frame.shape
+    if frame.shape != frame_shape:
+        # Camera ignored the requested size; re-derive layout once
+        frame_shape = frame.shape
+        h, w = frame_shape[:2]
+        infer_size = inference_size(w, h)
+        small_buf = np.empty((infer_size[1], infer_size[0], 3), np.uint8)
+        rgb_small_buf = np.empty_like(small_buf)
+        hud["overlay"] = None
     
-    # Convert to RGB
-    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    
-    # Process with MediaPipe
-    results = face_mesh.process(rgb_frame)
+    # Run inference every INFER_EVERY frames, reusing landmarks in between
+    if (frame_counter - 1) % INFER_EVERY == 0:
+        # Downscale and convert to RGB for inference
+        cv2.resize(frame, infer_size, dst=small_buf, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(small_buf, cv2.COLOR_BGR2RGB, dst=rgb_small_buf)
+        
+        # Process with MediaPipe (read-only input avoids an internal copy)
+        rgb_small_buf.flags.writeable = False
+        results = face_mesh.process(rgb_small_buf)
+        rgb_small_buf.flags.writeable = True
+        last_landmarks = results.multi_face_landmarks
     
     current_time = time.time()
     
-    if results.multi_face_landmarks:
-        for face_landmarks in results.multi_face_landmarks:
-            # Get eye coordinates
-            left_eye = get_landmark_coords(face_landmarks, LEFT_EYE_LANDMARKS, w, h)
-            right_eye = get_landmark_coords(face_landmarks, RIGHT_EYE_LANDMARKS, w, h)
+    hud["face"] = bool(last_landmarks)
+    hud["blink_started"] = False
+    hud["detected"] = None
+    
+    if last_landmarks:
+        for face_landmarks in last_landmarks:
+            # Get eye coordinates (rows 0-5 left eye, 6-11 right eye)
+            extract_eyes(face_landmarks, w, h, eye_buf)
             
             # Calculate EAR for both eyes
-            left_ear = calculate_ear(left_eye)
-            right_ear = calculate_ear(right_eye)
+            left_ear, right_ear = ear_pair(eye_buf.reshape(2, 6, 2)).tolist()
             
             # Average both eyes
             avg_ear = (left_ear + right_ear) / 2.0
             
-            # Store EAR history for smoothing
+            # Store EAR history for smoothing (running sum over ring buffer)
+            if len(ear_history) == ear_history.maxlen:
+                ear_sum -= ear_history[0]
             ear_history.append(avg_ear)
-            if len(ear_history) > 5:
-                ear_history.pop(0)
+            ear_sum += avg_ear
             
             # Use smoothed EAR
-            smooth_ear = np.mean(ear_history) if ear_history else avg_ear
+            smooth_ear = ear_sum / len(ear_history)
             
-            # Draw eye landmarks
-            for point in left_eye + right_eye:
-                cv2.circle(frame, tuple(point), 2, (0, 255, 0), -1)
+            # Draw eye landmarks and contours
+            draw_eye_landmarks(frame, eye_buf.astype(np.int32))
             
-            # Draw eye contours
-            left_contour = np.array(left_eye, np.int32)
-            right_contour = np.array(right_eye, np.int32)
-            cv2.polylines(frame, [left_contour], True, (255, 0, 0), 1)
-            cv2.polylines(frame, [right_contour], True, (255, 0, 0), 1)
+            if n_baseline < baseline.size:
+                # Collect open-eye baseline samples before detecting blinks
+                baseline[n_baseline] = smooth_ear
+                n_baseline += 1
+                if n_baseline == baseline.size:
+                    calibrated_threshold = compute_ear_threshold(baseline)
+                    if calibrated_threshold is not None:
+                        ear_threshold = calibrated_threshold
+                        log_q.put(f"[INFO] Calibrated EAR threshold: {ear_threshold:.3f}")
+                    else:
+                        log_q.put(f"[INFO] Calibration unusable; using default EAR threshold: {ear_threshold:.3f}")
+                    hud["threshold"] = ear_threshold
+                    hud["calibrating"] = False
+                    hud["overlay"] = None
+            else:
+                # Blink detection: counter resets arithmetically when the eye
+                # opens; a blink edge is any change of is_blinking
+                below = smooth_ear < ear_threshold
+                consec_blinks = (consec_blinks + below) * below
+                blink_started = (
+                    below
+                    & (not is_blinking)
+                    & (consec_blinks >= CONSEC_FRAMES)
+                    & ((current_time - last_blink_time) > MIN_BLINK_INTERVAL)
+                )
+                new_is_blinking = blink_started | (is_blinking & below)
             
-            # Blink detection
-            if smooth_ear < EAR_THRESHOLD:
-                consec_blinks += 1
-                
-                if not is_blinking and consec_blinks >= CONSEC_FRAMES:
-                    if (current_time - last_blink_time) > MIN_BLINK_INTERVAL:
-                        is_blinking = True
+                if is_blinking ^ new_is_blinking:
+                    if new_is_blinking:
                         blink_start_time = current_time
-                        print(f"[BLINK START] EAR: {smooth_ear:.3f}")
-                        
-                        # Visual feedback
-                        cv2.putText(frame, "BLINK DETECTED!", (50, 100),
-                                  cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-            else:
-                consec_blinks = 0
-                
-                if is_blinking:
-                    blink_duration = current_time - blink_start_time
-                    
-                    if len(blink_sequence) < MAX_BLINKS:
-                        if blink_duration < BLINK_DURATION_THRESHOLD:
-                            blink_type = "quick"
-                            digit = "0"
-                            color = (0, 255, 0)
-                        else:
-                            blink_type = "long"
-                            digit = "1"
-                            color = (0, 0, 255)
-                        
-                        blink_sequence.append(blink_type)
+                        hud["blink_started"] = True
+                        log_q.put(f"[BLINK START] EAR: {smooth_ear:.3f}")
+                    elif len(sequence_str) < MAX_BLINKS:
+                        blink_duration = current_time - blink_start_time
+                        digit = "0" if blink_duration < BLINK_DURATION_THRESHOLD else "1"
+                        sequence_str += digit
+                        hud["pin_count"] = len(sequence_str)
+                        hud["sequence"] = sequence_str
                         last_blink_time = current_time
-                        
-                        print(f"[DETECTED] {blink_type.upper()} blink ({blink_duration:.2f}s) -> {digit}")
-                        
-                        # Show detection on screen
-                        cv2.putText(frame, f"{blink_type.upper()} -> {digit}", (50, 150),
-                                  cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2)
-                    
-                    is_blinking = False
+                        hud["detected"] = digit
+                        log_q.put(f"[DETECTED] {'LONG' if digit == '1' else 'QUICK'} blink ({blink_duration:.2f}s) -> {digit}")
+                is_blinking = new_is_blinking
             
-            # Display EAR and status
-            cv2.putText(frame, f"EAR: {smooth_ear:.3f}", (w-150, 30),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-            cv2.putText(frame, f"Threshold: {EAR_THRESHOLD}", (w-150, 60),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+            hud["ear"] = smooth_ear
             
             # Debug info every 60 frames
             if frame_counter % 60 == 0:
-                print(f"[DEBUG] Current EAR: {smooth_ear:.3f} (Threshold: {EAR_THRESHOLD})")
-    
-    else:
-        cv2.putText(frame, "NO FACE DETECTED", (50, 50),
-                   cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+                log_q.put(f"[DEBUG] Current EAR: {smooth_ear:.3f} (Threshold: {ear_threshold:.3f})")
     
-    # Display progress
-    progress_text = f"PIN: {len(blink_sequence)}/{MAX_BLINKS}"
-    cv2.putText(frame, progress_text, (10, 30),
-               cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 0), 2)
-    
-    # Display current sequence
-    if blink_sequence:
-        sequence = "".join([BLINK_TO_DIGIT[b] for b in blink_sequence])
-        cv2.putText(frame, f"Sequence: {sequence}", (10, 70),
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 0), 2)
-    
-    # Instructions
-    cv2.putText(frame, "Quick=0, Long=1 | Q=Quit, R=Reset", (10, h-20),
-               cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+    # Draw status text once the frame's state is resolved
+    render_hud(frame, hud)
     
     # Show frame
     cv2.imshow("Blink-PIN Authentication", frame)
@@ -261,33 +257,39 @@ while True:
     if key == ord('q'):
         break
     elif key == ord('r'):
-        print("[INFO] Resetting sequence...")
-        blink_sequence = []
+        log_q.put("[INFO] Resetting sequence...")
+        sequence_str = ""
+        hud["pin_count"] = 0
+        hud["sequence"] = ""
         is_blinking = False
         consec_blinks = 0
     
     # Check completion
-    if len(blink_sequence) >= MAX_BLINKS:
-        print("[INFO] PIN entry complete!")
+    if len(sequence_str) >= MAX_BLINKS:
+        log_q.put("[INFO] PIN entry complete!")
         break
 
 # -------------------
 # CLEANUP & VALIDATION
 # -------------------
 
-cap.release()
+stop_log_worker(log_q, log_thread)
+if grabber.stop():
+    cap.release()
+else:
+    print("[ERROR] Camera thread did not stop; leaving the camera open")
 cv2.destroyAllWindows()
 if face_mesh is not None:
     face_mesh.close()
 
 # Validate PIN
-if len(blink_sequence) >= MAX_BLINKS:
-    entered_pin = "".join([BLINK_TO_DIGIT[b] for b in blink_sequence])
+if len(sequence_str) >= MAX_BLINKS:
+    entered_pin = sequence_str
     
-    print(f"\nBlink sequence: {blink_sequence}")
+    print(f"\nBlink sequence: {['long' if d == '1' else 'quick' for d in sequence_str]}")
     print(f"Entered PIN: {entered_pin}")
     
-    if hash_pin(entered_pin) == stored_hash:
+    if verify_pin(entered_pin, stored_hash):
         print("\n" + "="*50)
         print("   🎉 AUTHENTICATION SUCCESS! 🎉")
         print(f"   Welcome back, {username}!")
@@ -301,6 +303,6 @@ else:
     print("\n[INFO] PIN entry incomplete")
 
 print(f"\nSession Summary:")
-print(f"- Blinks detected: {len(blink_sequence)}")
-print(f"- EAR threshold: {EAR_THRESHOLD}")
+print(f"- Blinks detected: {len(sequence_str)}")
+print(f"- EAR threshold: {ear_threshold:.3f}")
 print(f"- Duration threshold: {BLINK_DURATION_THRESHOLD}s")
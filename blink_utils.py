@@ -10,23 +10,54 @@ from __future__ import annotations
 import os
 import json
 import time
+import queue
+import threading
 import hashlib
-from typing import List, Dict, Any
+import hmac
+import platform
+from typing import Dict, Any, Tuple
 
+import cv2
 import numpy as np
 
+try:
+    import orjson  # Optional: faster JSON encode/decode for the user store
+except ImportError:  # Fall back to the stdlib json module
+    orjson = None
+
+try:
+    from numba import njit  # Optional: compiles the per-frame EAR kernel
+except ImportError:  # Fall back to the NumPy implementation
+    njit = None
+
 # Reduce TensorFlow/Mediapipe verbose logging (INFO/WARN)
 os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
 
+# Best-effort hint for fewer TFLite/XNNPACK inference threads, for MediaPipe
+# builds that read these variables; the legacy solutions API is not known to
+# honor them, so this is not an enforced cap (set before importing mediapipe)
+os.environ.setdefault("TFLITE_XNNPACK_NUM_THREADS", "2")
+os.environ.setdefault("MEDIAPIPE_NUM_THREADS", "2")
+
 import mediapipe as mp
 
 # -------------------
 # CONSTANTS (keep in sync across scripts)
 # -------------------
 
-# Standard EAR threshold for blink detection
+# Standard EAR threshold for blink detection (fallback when no per-user
+# calibrated threshold is available)
 EAR_THRESHOLD: float = 0.25
 
+# Per-user threshold calibration: baseline duration (seconds) with eyes
+# open, how many standard deviations below the median EAR to place it,
+# the minimum margin below the median as a fraction of it, and the range
+# a calibrated threshold must fall in to be used
+CALIBRATION_SECONDS: float = 1.5
+THRESHOLD_SIGMA: float = 2.0
+THRESHOLD_MIN_MARGIN: float = 0.15
+THRESHOLD_RANGE = (0.12, 0.30)
+
 # Quick vs Long blink threshold (seconds)
 BLINK_DURATION_THRESHOLD: float = 0.4
 
@@ -39,66 +70,268 @@ CONSEC_FRAMES: int = 3
 # PIN length (number of blinks)
 MAX_BLINKS: int = 4
 
+# EAR moving-average window: duration (seconds), and the minimum size in
+# frames (also used when the camera does not report its FPS)
+EAR_SMOOTHING_SECONDS: float = 0.15
+EAR_HISTORY_SIZE: int = 5
+
+# PBKDF2 iterations for PIN hashing
+PIN_HASH_ITERATIONS: int = 100_000
+
 # Mapping from blink type to digit
 BLINK_TO_DIGIT = {
     "quick": "0",
     "long": "1",
 }
 
+# Requested camera frame size (width, height)
+FRAME_WIDTH: int = 640
+FRAME_HEIGHT: int = 480
+
+# Right-aligned HUD text starts this many pixels from the right edge
+HUD_RIGHT_MARGIN: int = 150
+
+# Run FaceMesh on every Nth frame; landmarks from the last inference are
+# reused in between (a blink spans more than CONSEC_FRAMES frames)
+INFER_EVERY: int = 2
+
+# Width of the frame fed to FaceMesh; the height follows the camera's aspect
+# ratio, and landmarks are normalized, so they still map onto the full-size
+# display frame
+INFERENCE_WIDTH: int = 320
+
 # MediaPipe face mesh helpers
 mp_face_mesh = mp.solutions.face_mesh
 
 # Eye landmark indices (MediaPipe Face Mesh)
 # Left eye: outer corner, top, top, inner corner, bottom, bottom
-LEFT_EYE_LANDMARKS = [33, 160, 158, 133, 153, 144]
-RIGHT_EYE_LANDMARKS = [362, 385, 387, 263, 373, 380]
+LEFT_EYE_LANDMARKS = (33, 160, 158, 133, 153, 144)
+RIGHT_EYE_LANDMARKS = (362, 385, 387, 263, 373, 380)
+
+# Both eyes in one array: rows [0:6] are the left eye, [6:12] the right eye
+EYE_INDICES = np.array(LEFT_EYE_LANDMARKS + RIGHT_EYE_LANDMARKS, dtype=np.int32)
+_EYE_INDEX_ROWS = tuple(enumerate(EYE_INDICES.tolist()))
+
+# Pixel offsets of a radius-2 filled dot, used to mark every landmark with
+# a single fancy-indexed write instead of one cv2.circle call per point
+_DOT_DY, _DOT_DX = (
+    np.array([(dy, dx) for dy in range(-2, 3) for dx in range(-2, 3) if dy * dy + dx * dx <= 4], dtype=np.int32)
+    .T.reshape(2, 1, -1)
+)
 
 
 # -------------------
 # MATH / VISION HELPERS
 # -------------------
 
-def hash_pin(pin: str) -> str:
-    """Hash PIN using SHA-256"""
-    return hashlib.sha256(pin.encode()).hexdigest()
+def _has_sha_extensions() -> bool | None:
+    """
+    Best-effort check for hardware SHA-256 (x86 SHA-NI, ARMv8 sha2).
+    Returns None when the CPU features cannot be read (e.g. on Windows).
+    """
+    if platform.system() == "Darwin" and platform.machine() == "arm64":
+        return True  # Every Apple silicon CPU has the ARMv8 SHA-2 instructions
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8", errors="ignore") as f:
+            flags = set(f.read().split())
+    except OSError:
+        return None
+    return bool(flags & {"sha_ni", "sha2"})
+
+
+def _select_pin_digest() -> str:
+    """
+    Pick the PBKDF2 digest: BLAKE2b only on CPUs known to lack SHA
+    extensions, SHA-256 otherwise (including when detection fails).
+    """
+    if _has_sha_extensions() is not False:
+        return "sha256"
+    try:
+        hashlib.pbkdf2_hmac("blake2b512", b"", b"", 1)
+    except ValueError:
+        return "sha256"
+    return "blake2b512"
+
+
+# Digest used for new PIN hashes, chosen once at import time
+PIN_HASH_DIGEST: str = _select_pin_digest()
+
+
+def _hash_pin_salted(
+    pin: str,
+    salt: bytes | None = None,
+    digest: str | None = None,
+    iterations: int = PIN_HASH_ITERATIONS,
+) -> Tuple[bytes, str]:
+    """Hash PIN like hash_pin, returning (salt, encoded_hash)."""
+    digest = digest or PIN_HASH_DIGEST
+    if salt is None:
+        salt = os.urandom(16)
+    dk = hashlib.pbkdf2_hmac(digest, pin.encode(), salt, iterations)
+    return salt, f"pbkdf2-{digest}${iterations}${salt.hex()}${dk.hex()}"
+
+
+def hash_pin(
+    pin: str,
+    salt: bytes | None = None,
+    digest: str | None = None,
+    iterations: int = PIN_HASH_ITERATIONS,
+) -> str:
+    """
+    Hash PIN with salted PBKDF2, returned as
+    "pbkdf2-<digest>$<iterations>$<salt_hex>$<hash_hex>".
+    A random 16-byte salt is used when salt is None.
+    """
+    return _hash_pin_salted(pin, salt, digest, iterations)[1]
 
 
-def calculate_ear(eye_points: List[List[float]]) -> float:
+def verify_pin(pin: str, stored_hash: str) -> bool:
     """
-    Calculate Eye Aspect Ratio using the standard formula.
-    eye_points should be 6 landmarks in this order:
-    [0] = outer corner
-    [1] = top point 1
-    [2] = top point 2
-    [3] = inner corner
-    [4] = bottom point 1
-    [5] = bottom point 2
+    Check a PIN against a stored hash from hash_pin.
+
+    Older records holding a bare unsalted SHA-256 hex digest are still
+    accepted.
     """
-    points = np.array(eye_points, dtype=np.float32)
+    if stored_hash.startswith("pbkdf2-"):
+        try:
+            scheme, iterations, salt_hex, _ = stored_hash.split("$")
+            candidate = hash_pin(pin, bytes.fromhex(salt_hex), scheme[len("pbkdf2-"):], int(iterations))
+        except ValueError:
+            return False
+        return hmac.compare_digest(candidate.encode(), stored_hash.encode())
+    return hmac.compare_digest(hashlib.sha256(pin.encode()).hexdigest().encode(), stored_hash.encode())
 
-    A = np.linalg.norm(points[1] - points[5])  # Vertical distance 1
-    B = np.linalg.norm(points[2] - points[4])  # Vertical distance 2
-    C = np.linalg.norm(points[0] - points[3])  # Horizontal distance
 
+def _ear_kernel(p: np.ndarray) -> float:
+    """
+    Scalar Eye Aspect Ratio over a (6, 2) array of points in the order
+    outer corner, top 1, top 2, inner corner, bottom 1, bottom 2;
+    compiled with Numba when available.
+    """
+    ax = p[1, 0] - p[5, 0]
+    ay = p[1, 1] - p[5, 1]
+    bx = p[2, 0] - p[4, 0]
+    by = p[2, 1] - p[4, 1]
+    cx = p[0, 0] - p[3, 0]
+    cy = p[0, 1] - p[3, 1]
+    A = (ax * ax + ay * ay) ** 0.5
+    B = (bx * bx + by * by) ** 0.5
+    C = (cx * cx + cy * cy) ** 0.5
     if C == 0:
         return 0.0
-    return float((A + B) / (2.0 * C))
+    return (A + B) / (2.0 * C)
+
+
+def _ear_pair_kernel(points: np.ndarray) -> np.ndarray:
+    """EAR of each eye in a (2, 6, 2) array; compiled with Numba when available."""
+    out = np.empty(points.shape[0], np.float64)
+    for i in range(points.shape[0]):
+        out[i] = _ear_kernel(points[i])
+    return out
+
 
+def _ear_pair_np(points: np.ndarray) -> np.ndarray:
+    """EAR of each eye in a (2, 6, 2) array with one vectorized pass."""
+    d_top = points[:, 1] - points[:, 5]
+    d_bot = points[:, 2] - points[:, 4]
+    d_h = points[:, 0] - points[:, 3]
+    A = np.hypot(d_top[:, 0], d_top[:, 1])
+    B = np.hypot(d_bot[:, 0], d_bot[:, 1])
+    C = np.hypot(d_h[:, 0], d_h[:, 1])
+    return np.divide(A + B, 2.0 * C, out=np.zeros_like(A), where=C != 0)
 
-def get_landmark_coords(landmarks, indices: List[int], width: int, height: int) -> List[List[int]]:
-    """Extract landmark coordinates and convert to pixel positions."""
-    coords: List[List[int]] = []
-    for idx in indices:
-        lm = landmarks.landmark[idx]
-        x = int(lm.x * width)
-        y = int(lm.y * height)
-        coords.append([x, y])
-    return coords
+
+# EAR of both eyes, compiled with Numba or falling back to NumPy; takes
+# the (2, 6, 2) view eye_buf.reshape(2, 6, 2) of the extract_eyes buffer.
+# Call once before the capture loop so JIT compilation happens up front.
+if njit is not None:
+    _ear_kernel = njit(cache=True, fastmath=True)(_ear_kernel)
+    ear_pair = njit(cache=True, fastmath=True)(_ear_pair_kernel)
+else:
+    ear_pair = _ear_pair_np
+
+
+def extract_eyes(face_landmarks, width: int, height: int, buf: np.ndarray) -> np.ndarray:
+    """
+    Write pixel positions of both eyes' landmarks into a preallocated
+    (12, 2) float32 buffer, in EYE_INDICES order, and return it.
+    """
+    lm = face_landmarks.landmark
+    for i, idx in _EYE_INDEX_ROWS:
+        point = lm[idx]
+        buf[i, 0] = point.x * width
+        buf[i, 1] = point.y * height
+    return buf
+
+
+def draw_eye_landmarks(frame: np.ndarray, eye_px: np.ndarray) -> None:
+    """
+    Draw landmark dots and closed contours for both eyes.
+
+    eye_px is the (12, 2) int32 pixel array (left eye rows first). All
+    dots are painted in one vectorized write, skipping pixels that fall
+    outside the frame as cv2.circle does, and both contours in one
+    cv2.polylines call.
+    """
+    h, w = frame.shape[:2]
+    ys = eye_px[:, 1:2] + _DOT_DY
+    xs = eye_px[:, 0:1] + _DOT_DX
+    inside = (ys >= 0) & (ys < h) & (xs >= 0) & (xs < w)
+    frame[ys[inside], xs[inside]] = (0, 255, 0)
+    cv2.polylines(frame, [eye_px[:6], eye_px[6:]], True, (255, 0, 0), 1)
+
+
+def ear_window_size(fps: float) -> int:
+    """
+    Return the EAR moving-average window length in frames for a capture FPS,
+    never shorter than EAR_HISTORY_SIZE so landmark jitter stays smoothed.
+    """
+    if not fps or fps <= 0:
+        return EAR_HISTORY_SIZE
+    return max(EAR_HISTORY_SIZE, round(EAR_SMOOTHING_SECONDS * fps))
+
+
+def inference_size(width: int, height: int) -> Tuple[int, int]:
+    """Return the (width, height) to downscale a frame to for FaceMesh, keeping its aspect ratio."""
+    return INFERENCE_WIDTH, max(1, round(INFERENCE_WIDTH * height / width))
+
+
+def calibration_frames(fps: float) -> int:
+    """Return how many face frames to collect for the baseline EAR at a capture FPS."""
+    if not fps or fps <= 0:
+        fps = 30.0
+    return max(2, int(CALIBRATION_SECONDS * fps))
+
+
+def compute_ear_threshold(baseline: np.ndarray) -> float | None:
+    """
+    Derive a per-user EAR threshold from open-eye baseline samples:
+    median - max(THRESHOLD_SIGMA * std, THRESHOLD_MIN_MARGIN * median).
+
+    Returns None when the result falls outside THRESHOLD_RANGE (e.g. the
+    user blinked or looked away while calibrating); callers then use
+    EAR_THRESHOLD and must not store the value.
+    """
+    if baseline.size < 2:
+        return None
+    mu = float(np.median(baseline))
+    sigma = float(baseline.std(ddof=1))
+    threshold = mu - max(THRESHOLD_SIGMA * sigma, THRESHOLD_MIN_MARGIN * mu)
+    if not THRESHOLD_RANGE[0] <= threshold <= THRESHOLD_RANGE[1]:
+        return None
+    return threshold
+
+
+def configure_opencv(num_threads: int = 2) -> None:
+    """Enable OpenCV's optimized (SIMD/IPP) code paths and cap its thread pool."""
+    cv2.setUseOptimized(True)
+    cv2.setNumThreads(num_threads)
 
 
 def create_face_mesh():
     """Create a configured MediaPipe FaceMesh instance."""
     return mp_face_mesh.FaceMesh(
+        static_image_mode=False,
         max_num_faces=1,
         refine_landmarks=True,
         min_detection_confidence=0.5,
@@ -106,6 +339,175 @@ def create_face_mesh():
     )
 
 
+def build_hud_overlay(shape: Tuple[int, ...], threshold: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pre-render the HUD text that does not change during a session.
+
+    Returns (overlay, face_mask, base_mask): the rendered text image, a
+    mask covering all of it, and a mask covering only the text shown
+    when no face is detected.
+    """
+    h, w = shape[:2]
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    overlay = np.zeros((h, w, 3), np.uint8)
+
+    cv2.putText(overlay, "Quick=0, Long=1 | Q=Quit, R=Reset", (10, h - 20), font, 0.5, (0, 255, 255), 1)
+    base_mask = overlay.any(axis=2).astype(np.uint8)
+
+    cv2.putText(overlay, "Threshold: %.3f" % threshold, (w - HUD_RIGHT_MARGIN, 60), font, 0.6, (255, 255, 255), 2)
+    face_mask = overlay.any(axis=2).astype(np.uint8)
+
+    return overlay, face_mask, base_mask
+
+
+def render_hud(frame: np.ndarray, state: Dict[str, Any]) -> None:
+    """
+    Draw all on-screen status text for one frame.
+
+    Called once per iteration, after the blink state has been resolved.
+    state keys: face (bool), ear (float), threshold (float),
+    calibrating (bool), blink_started (bool), detected (digit of the blink
+    just recorded, or None),
+    pin_count (int), sequence (str), overlay (build_hud_overlay result,
+    or None to rebuild it on the next call, e.g. after the frame size or
+    threshold changes).
+    """
+    font = cv2.FONT_HERSHEY_SIMPLEX
+
+    overlay = state.get("overlay")
+    if overlay is None:
+        overlay = state["overlay"] = build_hud_overlay(frame.shape, state["threshold"])
+        state["x_hud"] = frame.shape[1] - HUD_RIGHT_MARGIN
+    static_text, face_mask, base_mask = overlay
+
+    if state["face"]:
+        cv2.copyTo(static_text, face_mask, frame)
+
+        if state["blink_started"]:
+            cv2.putText(frame, "BLINK DETECTED!", (50, 100), font, 1, (0, 0, 255), 2)
+
+        digit = state["detected"]
+        if digit is not None:
+            is_long = digit == "1"
+            color = (0, 0, 255) if is_long else (0, 255, 0)
+            cv2.putText(
+                frame,
+                "%s -> %s" % ("LONG" if is_long else "QUICK", digit),
+                (50, 150),
+                font,
+                1,
+                color,
+                2,
+            )
+
+        if state["calibrating"]:
+            cv2.putText(frame, "CALIBRATING - keep eyes open", (50, 100), font, 0.8, (0, 255, 255), 2)
+
+        cv2.putText(frame, "EAR: %.3f" % state["ear"], (state["x_hud"], 30), font, 0.6, (255, 255, 255), 2)
+    else:
+        cv2.copyTo(static_text, base_mask, frame)
+        cv2.putText(frame, "NO FACE DETECTED", (50, 50), font, 1, (0, 0, 255), 2)
+
+    cv2.putText(frame, "PIN: %d/%d" % (state["pin_count"], MAX_BLINKS), (10, 30), font, 0.8, (255, 255, 0), 2)
+
+    if state["sequence"]:
+        cv2.putText(frame, "Sequence: %s" % state["sequence"], (10, 70), font, 0.8, (255, 255, 0), 2)
+
+
+# -------------------
+# CAMERA CAPTURE
+# -------------------
+
+class FrameGrabber(threading.Thread):
+    """
+    Pull frames from a cv2.VideoCapture on a background thread.
+
+    grab()/retrieve() run continuously so driver latency overlaps with
+    inference on the main thread; read() hands out the newest frame.
+    Frames that arrive while the caller is busy are dropped, so when the
+    loop is slower than the camera, per-frame counts cover fewer frames
+    per second than the reported capture FPS.
+    """
+
+    def __init__(self, cap: cv2.VideoCapture) -> None:
+        super().__init__(name="blink-capture", daemon=True)
+        self.cap = cap
+        self.running = True
+        self._cond = threading.Condition()
+        self._frame: np.ndarray | None = None
+        self._ok = False
+        self._seq = 0
+        self._read_seq = 0
+
+    def run(self) -> None:
+        while self.running:
+            ok = self.cap.grab()
+            frame = self.cap.retrieve()[1] if ok else None
+            with self._cond:
+                self._ok = ok and frame is not None
+                self._frame = frame
+                self._seq += 1
+                if not self._ok:
+                    self.running = False
+                self._cond.notify_all()
+
+    def read(self, timeout: float = 5.0) -> Tuple[bool, np.ndarray | None]:
+        """Return (ok, frame) for the newest frame not yet read, waiting if needed."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq != self._read_seq or not self.running, timeout)
+            if self._seq == self._read_seq:
+                return False, None
+            self._read_seq = self._seq
+            return self._ok, self._frame
+
+    def stop(self, timeout: float = 2.0) -> bool:
+        """
+        Stop grabbing and wait up to timeout seconds for the thread to exit.
+
+        Returns False if it is still running, e.g. in a grab() stuck on an
+        unplugged camera; the capture is then still in use and must not be
+        released.
+        """
+        self.running = False
+        if self.is_alive():
+            self.join(timeout)
+        return not self.is_alive()
+
+
+# -------------------
+# CONSOLE LOGGING
+# -------------------
+
+_LOG_STOP = object()
+
+
+def start_log_worker() -> Tuple[queue.SimpleQueue, threading.Thread]:
+    """
+    Start a daemon thread that prints messages put on the returned queue.
+
+    Lets the camera loop hand off console output with a non-blocking
+    put() instead of waiting on stdout.
+    """
+    log_q: queue.SimpleQueue = queue.SimpleQueue()
+
+    def drain() -> None:
+        while True:
+            msg = log_q.get()
+            if msg is _LOG_STOP:
+                break
+            print(msg)
+
+    thread = threading.Thread(target=drain, name="blink-log", daemon=True)
+    thread.start()
+    return log_q, thread
+
+
+def stop_log_worker(log_q: queue.SimpleQueue, thread: threading.Thread) -> None:
+    """Flush pending messages and stop the thread from start_log_worker."""
+    log_q.put(_LOG_STOP)
+    thread.join()
+
+
 # -------------------
 # USER STORE HELPERS
 # -------------------
@@ -116,41 +518,82 @@ def users_store_path() -> str:
     return os.path.join(base_dir, "users.json")
 
 
+# In-process cache of users.json, keyed on the file's modification time so
+# edits made by another process are picked up on the next load
+_USERS_CACHE: Dict[str, Any] | None = None
+_USERS_MTIME: int = 0
+
+
 def load_users() -> Dict[str, Any]:
-    """Load users database from JSON, returning a dict with a 'users' key."""
+    """Load users database from JSON, returning a dict with a 'users' key.
+
+    The parsed dict is cached and reused until users.json changes on disk,
+    so callers must treat it as read-only; build a new dict and pass it to
+    save_users to make changes.
+    """
+    global _USERS_CACHE, _USERS_MTIME
     path = users_store_path()
-    if not os.path.exists(path):
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        _USERS_CACHE = None
         return {"users": {}}
+    if _USERS_CACHE is not None and mtime == _USERS_MTIME:
+        return _USERS_CACHE
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(path, "rb") as f:
+            raw = f.read()
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
         if not isinstance(data, dict) or "users" not in data:
-            return {"users": {}}
+            data = {"users": {}}
         if not isinstance(data["users"], dict):
             data["users"] = {}
-        return data
     except Exception:
         # Corrupt file fallback
-        return {"users": {}}
+        data = {"users": {}}
+    _USERS_CACHE = data
+    _USERS_MTIME = mtime
+    return data
 
 
 def save_users(data: Dict[str, Any]) -> None:
-    """Persist users database to JSON."""
-    path = users_store_path()
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
+    """Persist users database to JSON and refresh the in-process cache.
 
-def set_user_pin(username: str, pin_plain: str) -> None:
+    The file is written to a temporary sibling and atomically renamed over
+    users.json, so a crash mid-write never leaves a truncated database.
+    """
+    global _USERS_CACHE, _USERS_MTIME
+    path = users_store_path()
+    if orjson is not None:
+        payload = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    else:
+        payload = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _USERS_CACHE = data
+    _USERS_MTIME = os.stat(path).st_mtime_ns
+
+
+def set_user_pin(username: str, pin_plain: str, ear_threshold: float | None = None) -> None:
     """Set or update the user's PIN hash and metadata."""
     db = load_users()
-    db.setdefault("users", {})
-    db["users"][username] = {
-        "pin_hash": hash_pin(pin_plain),
+    salt, pin_hash = _hash_pin_salted(pin_plain)
+    record = {
+        "pin_hash": pin_hash,
+        "salt": salt.hex(),
         "pin_length": len(pin_plain),
         "updated_at": time.time(),
     }
-    save_users(db)
+    if ear_threshold is not None:
+        record["ear_threshold"] = ear_threshold
+    # Update a copy: the cached dict only changes once save_users succeeds
+    users = dict(db.get("users", {}))
+    users[username] = record
+    save_users({**db, "users": users})
 
 
 def get_user_pin_hash(username: str) -> str | None:
@@ -168,3 +611,15 @@ def get_user_pin_length(username: str, default_length: int = MAX_BLINKS) -> int:
     if not user:
         return default_length
     return int(user.get("pin_length", default_length))
+
+
+def get_user_ear_threshold(username: str) -> float | None:
+    """Return the user's calibrated EAR threshold, if a usable one was stored."""
+    db = load_users()
+    user = db.get("users", {}).get(username)
+    if not user or "ear_threshold" not in user:
+        return None
+    threshold = float(user["ear_threshold"])
+    if not THRESHOLD_RANGE[0] <= threshold <= THRESHOLD_RANGE[1]:
+        return None
+    return threshold
@@ -15,21 +15,33 @@ Requirements:
 from __future__ import annotations
 
 import time
+from collections import deque
+
 import cv2
 import numpy as np
 
 from blink_utils import (
-    BLINK_TO_DIGIT,
     EAR_THRESHOLD,
     BLINK_DURATION_THRESHOLD,
     MIN_BLINK_INTERVAL,
     CONSEC_FRAMES,
     MAX_BLINKS,
-    LEFT_EYE_LANDMARKS,
-    RIGHT_EYE_LANDMARKS,
-    calculate_ear,
-    get_landmark_coords,
+    FRAME_WIDTH,
+    FRAME_HEIGHT,
+    INFER_EVERY,
+    ear_pair,
+    extract_eyes,
+    draw_eye_landmarks,
+    inference_size,
+    ear_window_size,
+    calibration_frames,
+    compute_ear_threshold,
+    configure_opencv,
     create_face_mesh,
+    FrameGrabber,
+    start_log_worker,
+    stop_log_worker,
+    render_hud,
     set_user_pin,
 )
 
@@ -44,6 +56,7 @@ def main() -> None:
         print("[ERROR] Username cannot be empty.")
         return
 
+    configure_opencv()
     face_mesh = create_face_mesh()
 
     cap = cv2.VideoCapture(0)
@@ -52,200 +65,187 @@ def main() -> None:
         face_mesh.close()
         return
 
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
 
-    blink_sequence = []
+    sequence_str = ""
     frame_counter = 0
-    ear_history = []
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    ear_history = deque(maxlen=ear_window_size(fps))
+    ear_sum = 0.0
     is_blinking = False
     blink_start_time = 0.0
     last_blink_time = 0.0
     consec_blinks = 0
-
-    print("[INFO] Camera initialized. Start blinking to set your PIN...")
+    eye_buf = np.zeros((12, 2), np.float32)
+    ear_pair(eye_buf.reshape(2, 6, 2))  # Compile the EAR kernel before the loop
+    last_landmarks = None
+    frame_shape = (FRAME_HEIGHT, FRAME_WIDTH, 3)
+    h, w = FRAME_HEIGHT, FRAME_WIDTH
+    infer_size = inference_size(w, h)
+    small_buf = np.empty((infer_size[1], infer_size[0], 3), np.uint8)
+    rgb_small_buf = np.empty_like(small_buf)
+
+    # Per-user EAR threshold, calibrated from the first face frames; only
+    # a usable calibration is stored with the PIN
+    ear_threshold = EAR_THRESHOLD
+    calibrated_threshold = None
+    baseline = np.empty(calibration_frames(fps), np.float64)
+    n_baseline = 0
+
+    hud = {
+        "face": False,
+        "ear": 0.0,
+        "threshold": ear_threshold,
+        "calibrating": True,
+        "blink_started": False,
+        "detected": None,
+        "pin_count": 0,
+        "sequence": "",
+        "overlay": None,
+    }
+
+    print("[INFO] Camera initialized. Keep your eyes open while calibrating, then blink your PIN...")
+
+    # Console output from inside the capture loop goes through a background thread
+    log_q, log_thread = start_log_worker()
+
+    grabber = FrameGrabber(cap)
+    grabber.start()
 
     try:
         while True:
-            ret, frame = cap.read()
+            ret, frame = grabber.read()
             if not ret:
-                print("[ERROR] Failed to read frame")
+                log_q.put("[ERROR] Failed to read frame")
                 break
 
             frame_counter += 1
             frame = cv2.flip(frame, 1)
-            h, w, _ = frame.shape
-
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            results = face_mesh.process(rgb_frame)
+            if frame.shape != frame_shape:
+                # Camera ignored the requested size; re-derive layout once
+                frame_shape = frame.shape
+                h, w = frame_shape[:2]
+                infer_size = inference_size(w, h)
+                small_buf = np.empty((infer_size[1], infer_size[0], 3), np.uint8)
+                rgb_small_buf = np.empty_like(small_buf)
+                hud["overlay"] = None
+
+            if (frame_counter - 1) % INFER_EVERY == 0:
+                cv2.resize(frame, infer_size, dst=small_buf, interpolation=cv2.INTER_AREA)
+                cv2.cvtColor(small_buf, cv2.COLOR_BGR2RGB, dst=rgb_small_buf)
+                rgb_small_buf.flags.writeable = False
+                results = face_mesh.process(rgb_small_buf)
+                rgb_small_buf.flags.writeable = True
+                last_landmarks = results.multi_face_landmarks
             current_time = time.time()
 
-            if results.multi_face_landmarks:
-                for face_landmarks in results.multi_face_landmarks:
-                    left_eye = get_landmark_coords(face_landmarks, LEFT_EYE_LANDMARKS, w, h)
-                    right_eye = get_landmark_coords(face_landmarks, RIGHT_EYE_LANDMARKS, w, h)
+            hud["face"] = bool(last_landmarks)
+            hud["blink_started"] = False
+            hud["detected"] = None
 
-                    left_ear = calculate_ear(left_eye)
-                    right_ear = calculate_ear(right_eye)
+            if last_landmarks:
+                for face_landmarks in last_landmarks:
+                    extract_eyes(face_landmarks, w, h, eye_buf)
+
+                    left_ear, right_ear = ear_pair(eye_buf.reshape(2, 6, 2)).tolist()
                     avg_ear = (left_ear + right_ear) / 2.0
 
+                    # Running-sum moving average over the ring buffer
+                    if len(ear_history) == ear_history.maxlen:
+                        ear_sum -= ear_history[0]
                     ear_history.append(avg_ear)
-                    if len(ear_history) > 5:
-                        ear_history.pop(0)
-
-                    smooth_ear = float(np.mean(ear_history)) if ear_history else avg_ear
+                    ear_sum += avg_ear
+                    smooth_ear = ear_sum / len(ear_history)
 
                     # Draw landmarks
-                    for point in left_eye + right_eye:
-                        cv2.circle(frame, tuple(point), 2, (0, 255, 0), -1)
-
-                    left_contour = np.array(left_eye, np.int32)
-                    right_contour = np.array(right_eye, np.int32)
-                    cv2.polylines(frame, [left_contour], True, (255, 0, 0), 1)
-                    cv2.polylines(frame, [right_contour], True, (255, 0, 0), 1)
-
-                    # Blink detection
-                    if smooth_ear < EAR_THRESHOLD:
-                        consec_blinks += 1
-                        if not is_blinking and consec_blinks >= CONSEC_FRAMES:
-                            if (current_time - last_blink_time) > MIN_BLINK_INTERVAL:
-                                is_blinking = True
-                                blink_start_time = current_time
-                                print(f"[BLINK START] EAR: {smooth_ear:.3f}")
-                                cv2.putText(
-                                    frame,
-                                    "BLINK DETECTED!",
-                                    (50, 100),
-                                    cv2.FONT_HERSHEY_SIMPLEX,
-                                    1,
-                                    (0, 0, 255),
-                                    2,
-                                )
+                    draw_eye_landmarks(frame, eye_buf.astype(np.int32))
+
+                    if n_baseline < baseline.size:
+                        # Collect open-eye baseline samples before detecting blinks
+                        baseline[n_baseline] = smooth_ear
+                        n_baseline += 1
+                        if n_baseline == baseline.size:
+                            calibrated_threshold = compute_ear_threshold(baseline)
+                            if calibrated_threshold is not None:
+                                ear_threshold = calibrated_threshold
+                                log_q.put(f"[INFO] Calibrated EAR threshold: {ear_threshold:.3f}")
+                            else:
+                                log_q.put(f"[INFO] Calibration unusable; using default EAR threshold: {ear_threshold:.3f}")
+                            hud["threshold"] = ear_threshold
+                            hud["calibrating"] = False
+                            hud["overlay"] = None
                     else:
-                        consec_blinks = 0
-                        if is_blinking:
-                            blink_duration = current_time - blink_start_time
-
-                            if len(blink_sequence) < MAX_BLINKS:
-                                if blink_duration < BLINK_DURATION_THRESHOLD:
-                                    blink_type = "quick"
-                                    digit = "0"
-                                    color = (0, 255, 0)
-                                else:
-                                    blink_type = "long"
-                                    digit = "1"
-                                    color = (0, 0, 255)
-
-                                blink_sequence.append(blink_type)
+                        # Blink detection: counter resets arithmetically when the
+                        # eye opens; a blink edge is any change of is_blinking.
+                        below = smooth_ear < ear_threshold
+                        consec_blinks = (consec_blinks + below) * below
+                        blink_started = (
+                            below
+                            & (not is_blinking)
+                            & (consec_blinks >= CONSEC_FRAMES)
+                            & ((current_time - last_blink_time) > MIN_BLINK_INTERVAL)
+                        )
+                        new_is_blinking = blink_started | (is_blinking & below)
+
+                        if is_blinking ^ new_is_blinking:
+                            if new_is_blinking:
+                                blink_start_time = current_time
+                                hud["blink_started"] = True
+                                log_q.put(f"[BLINK START] EAR: {smooth_ear:.3f}")
+                            elif len(sequence_str) < MAX_BLINKS:
+                                blink_duration = current_time - blink_start_time
+                                digit = "0" if blink_duration < BLINK_DURATION_THRESHOLD else "1"
+                                sequence_str += digit
+                                hud["pin_count"] = len(sequence_str)
+                                hud["sequence"] = sequence_str
                                 last_blink_time = current_time
-                                print(
-                                    f"[DETECTED] {blink_type.upper()} blink ({blink_duration:.2f}s) -> {digit}"
+                                hud["detected"] = digit
+                                log_q.put(
+                                    f"[DETECTED] {'LONG' if digit == '1' else 'QUICK'} blink ({blink_duration:.2f}s) -> {digit}"
                                 )
+                        is_blinking = new_is_blinking
 
-                                cv2.putText(
-                                    frame,
-                                    f"{blink_type.upper()} -> {digit}",
-                                    (50, 150),
-                                    cv2.FONT_HERSHEY_SIMPLEX,
-                                    1,
-                                    color,
-                                    2,
-                                )
-
-                            is_blinking = False
-
-                    # HUD
-                    cv2.putText(
-                        frame,
-                        f"EAR: {smooth_ear:.3f}",
-                        (w - 150, 30),
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        0.6,
-                        (255, 255, 255),
-                        2,
-                    )
-                    cv2.putText(
-                        frame,
-                        f"Threshold: {EAR_THRESHOLD}",
-                        (w - 150, 60),
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        0.6,
-                        (255, 255, 255),
-                        2,
-                    )
+                    hud["ear"] = smooth_ear
 
                     if frame_counter % 60 == 0:
-                        print(f"[DEBUG] Current EAR: {smooth_ear:.3f} (Threshold: {EAR_THRESHOLD})")
-            else:
-                cv2.putText(
-                    frame,
-                    "NO FACE DETECTED",
-                    (50, 50),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    1,
-                    (0, 0, 255),
-                    2,
-                )
-
-            progress_text = f"PIN: {len(blink_sequence)}/{MAX_BLINKS}"
-            cv2.putText(
-                frame,
-                progress_text,
-                (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.8,
-                (255, 255, 0),
-                2,
-            )
-
-            if blink_sequence:
-                sequence = "".join([BLINK_TO_DIGIT[b] for b in blink_sequence])
-                cv2.putText(
-                    frame,
-                    f"Sequence: {sequence}",
-                    (10, 70),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.8,
-                    (255, 255, 0),
-                    2,
-                )
-
-            cv2.putText(
-                frame,
-                "Quick=0, Long=1 | Q=Quit, R=Reset",
-                (10, h - 20),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.5,
-                (0, 255, 255),
-                1,
-            )
+                        log_q.put(f"[DEBUG] Current EAR: {smooth_ear:.3f} (Threshold: {ear_threshold:.3f})")
+
+            render_hud(frame, hud)
 
             cv2.imshow("Register Blink-PIN", frame)
 
             key = cv2.waitKey(1) & 0xFF
             if key == ord("q"):
-                print("[INFO] Quit requested. Registration aborted.")
+                log_q.put("[INFO] Quit requested. Registration aborted.")
                 break
             elif key == ord("r"):
-                print("[INFO] Resetting sequence...")
-                blink_sequence = []
+                log_q.put("[INFO] Resetting sequence...")
+                sequence_str = ""
+                hud["pin_count"] = 0
+                hud["sequence"] = ""
                 is_blinking = False
                 consec_blinks = 0
 
-            if len(blink_sequence) >= MAX_BLINKS:
-                print("[INFO] PIN capture complete!")
+            if len(sequence_str) >= MAX_BLINKS:
+                log_q.put("[INFO] PIN capture complete!")
                 break
     finally:
-        cap.release()
+        stop_log_worker(log_q, log_thread)
+        if grabber.stop():
+            cap.release()
+        else:
+            print("[ERROR] Camera thread did not stop; leaving the camera open")
         cv2.destroyAllWindows()
         face_mesh.close()
 
     # Save if complete
-    if len(blink_sequence) >= MAX_BLINKS:
-        pin_str = "".join([BLINK_TO_DIGIT[b] for b in blink_sequence])
-        print(f"\nBlink sequence: {blink_sequence}")
+    if len(sequence_str) >= MAX_BLINKS:
+        pin_str = sequence_str
+        print(f"\nBlink sequence: {['long' if d == '1' else 'quick' for d in sequence_str]}")
         print(f"PIN: {pin_str}")
-        set_user_pin(username, pin_str)
+        set_user_pin(username, pin_str, calibrated_threshold)
         print("[SUCCESS] PIN registered for user:", username)
     else:
         print("[INFO] Registration incomplete; nothing saved.")